@@ -1,28 +1,33 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
 import plotly.express as px
 from datetime import datetime
 import os
 import json
-from streamlit_autorefresh import st_autorefresh
 import urllib.parse
 from google.cloud import bigquery
 
 # --- Mecanismo de alerta global (vários alertas) ---
 
+@st.cache_resource(show_spinner=False)
+def criar_cliente_bigquery():
+    """Cria o cliente do BigQuery uma única vez por processo e o reaproveita entre sessões"""
+    credentials_json = st.secrets["bigquery_credentials"]
+    credentials_dict = json.loads(credentials_json)
+
+    print("Project ID:", credentials_dict["project_id"])
+
+    return bigquery.Client.from_service_account_info(
+        credentials_dict,
+        project=credentials_dict["project_id"]
+    )
+
 def conectar_bigquery():
     """Conecta ao BigQuery usando credenciais armazenadas nos secrets do Streamlit"""
     try:
-        credentials_json = st.secrets["bigquery_credentials"]
-        credentials_dict = json.loads(credentials_json)
-        
-        print("Project ID:", credentials_dict["project_id"])
-        
-        client = bigquery.Client.from_service_account_info(
-            credentials_dict,
-            project=credentials_dict["project_id"]
-        )
-        return client
+        return criar_cliente_bigquery()
     except Exception as e:
         st.error(f"Erro ao conectar ao BigQuery: {str(e)}")
         st.error(f"Detalhes do erro: {type(e).__name__}")
@@ -30,164 +35,225 @@ def conectar_bigquery():
         return None
 
 
+def executar_consulta(client, query):
+    """Executa a consulta no BigQuery e devolve o resultado como DataFrame"""
+    # Baixa o resultado pela BigQuery Storage Read API (Arrow/gRPC) em vez da API REST,
+    # mantendo as colunas de texto em Arrow em vez de objetos Python
+    return client.query(query).to_dataframe(
+        create_bqstorage_client=True,
+        string_dtype=pd.ArrowDtype(pa.string())
+    )
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def carregar_campanhas(_client):
+    """Busca as campanhas e já devolve as colunas convertidas; fica em cache por 5 minutos"""
+    query = """
+    SELECT
+        insertion_order,
+        modelo,
+        volume_contratado,
+        budget,
+        inicio_campanha,
+        fim_campanha
+    FROM `banco-de-dados-weach-451217.banco_inicial.campanhas`
+    """
+    df_campanhas = executar_consulta(_client, query)
+
+    # Converte as datas uma única vez, já no carregamento
+    colunas_data = ['inicio_campanha', 'fim_campanha']
+    df_campanhas[colunas_data] = df_campanhas[colunas_data].apply(pd.to_datetime, cache=True)
+
+    # Converte o budget ("R$ 1.234,56") para número uma única vez
+    # (valores inválidos viram NaN para não derrubar o dashboard, que não usa o budget;
+    # a página programática ignora essas campanhas e avisa quais foram)
+    df_campanhas['budget_num'] = pd.to_numeric(
+        df_campanhas['budget']
+        .str.replace(r'R\$\s*', '', regex=True)
+        .str.replace('.', '', regex=False)
+        .str.replace(',', '.', regex=False),
+        errors='coerce'
+    ).to_numpy(dtype='float64', na_value=np.nan)
+
+    # Poucos modelos distintos: categoria compara por código inteiro
+    df_campanhas['modelo'] = df_campanhas['modelo'].astype('category')
+    return df_campanhas
+
 def get_campaign_data(client):
     """Busca dados das campanhas do BigQuery"""
     try:
-        query = """
-        SELECT *
-        FROM `banco-de-dados-weach-451217.banco_inicial.campanhas`
-        """
-        df_campanhas = client.query(query).to_dataframe()
-        return df_campanhas
+        return carregar_campanhas(client)
     except Exception as e:
         st.error(f"Erro ao buscar campanhas: {e}")
         return None
 
-def get_daily_data(client):
-    """Busca dados diários do BigQuery com join nas condições especificadas"""
+# Join das entregas diárias com as campanhas (dentro do período de cada campanha), agrupado por
+# Insertion Order. Compartilhado pelas consultas de entregas e de revenue para as duas páginas
+# usarem sempre a mesma janela de datas.
+FROM_ENTREGAS_POR_CAMPANHA = """
+    FROM 
+        `banco-de-dados-weach-451217.banco_inicial.teste` t
+    JOIN 
+        `banco-de-dados-weach-451217.banco_inicial.campanhas` c
+    ON 
+        t.`Insertion Order` = c.insertion_order
+    AND 
+        t.Date BETWEEN c.inicio_campanha AND c.fim_campanha
+    GROUP BY 
+        t.`Insertion Order`
+"""
+
+@st.cache_data(ttl=300, show_spinner=False)
+def carregar_entregas(_client):
+    """Busca as entregas já agregadas por campanha no BigQuery; fica em cache por 5 minutos"""
+    query = f"""
+    SELECT 
+        t.`Insertion Order` AS insertion_order,
+        SUM(t.Impressions) AS Impressions,
+        SUM(t.Clicks) AS Clicks,
+        SUM(t.Complete_Views) AS Complete_Views,
+        -- Entrega do dia mais recente de cada campanha
+        ARRAY_AGG(t.Impressions ORDER BY t.Date DESC LIMIT 1)[OFFSET(0)] AS Ultima_Impressions,
+        ARRAY_AGG(t.Complete_Views ORDER BY t.Date DESC LIMIT 1)[OFFSET(0)] AS Ultima_Complete_Views
+    {FROM_ENTREGAS_POR_CAMPANHA}
+    """
+    return executar_consulta(_client, query)
+
+def get_delivery_data(client):
+    """Busca as entregas já agregadas por campanha no BigQuery, com join nas condições especificadas"""
     try:
-        query = """
-        SELECT 
-            t.`Insertion Order`,  -- Usando crases para escapar o nome da coluna
-            t.Date,
-            t.Impressions,
-            t.Clicks,
-            t.Complete_Views,
-            t.Revenue
-        FROM 
-            `banco-de-dados-weach-451217.banco_inicial.teste` t
-        JOIN 
-            `banco-de-dados-weach-451217.banco_inicial.campanhas` c
-        ON 
-            t.`Insertion Order` = c.insertion_order
-        AND 
-            t.Date BETWEEN c.inicio_campanha AND c.fim_campanha
-        """
-        df_daily = client.query(query).to_dataframe()
-        return df_daily
+        return carregar_entregas(client)
     except Exception as e:
-        st.error(f"Erro ao buscar dados diários: {e}")
+        st.error(f"Erro ao buscar entregas: {e}")
         return None
 
-def calcular_metricas(df_campanhas, df_daily):
-    resultados = []
-    
-    for _, campanha in df_campanhas.iterrows():
-        try:
-            inicio = pd.to_datetime(campanha['inicio_campanha']).date()
-            fim = pd.to_datetime(campanha['fim_campanha']).date()
-            data_atual = datetime.now().date()  # Data atual
-            
-            # Verifica se a campanha já terminou
-            if fim < data_atual:
-                continue  # Ignora campanhas que já terminaram
-            
-            # Calcula os dias totais e dias decorridos
-            dias_totais = (fim - inicio).days + 1
-            dias_decorridos = (data_atual - inicio).days + 1
-            
-            # Calcula a meta diária
-            meta_diaria = float(campanha['volume_contratado']) / dias_totais
-            
-            # Filtra os dados da campanha
-            dados_campanha = df_daily[df_daily['Insertion Order'] == campanha['insertion_order']]
-            dados_campanha = dados_campanha.sort_values('Date', ascending=True)  # Ordena por data
-            
-            # Calcula o volume acumulado até o momento
-            volume_acumulado = dados_campanha['Impressions'].sum() if campanha['modelo'] == 'CPM' else dados_campanha['Complete_Views'].sum()
-            
-            # Calcula o volume esperado até o momento
-            volume_esperado = meta_diaria * dias_decorridos
-            
-            # Calcula o pace acumulado
-            pace_acumulado = (volume_acumulado / volume_esperado * 100) if volume_esperado > 0 else 0
-            
-            # Define o status com base no pace acumulado
-            if pace_acumulado < 90:
-                status = "Under"
-            elif pace_acumulado > 110:
-                status = "Over"
-            else:
-                status = "On Track"
-            
-            # Calcula a métrica principal (Impressions ou Complete_Views)
-            metrica = 'Impressions' if campanha['modelo'] == 'CPM' else 'Complete_Views'
-            ultima_metrica = dados_campanha.iloc[-1][metrica] if not dados_campanha.empty else 0
-            
-            # Verifica o modelo da campanha para calcular o Underperforming
-            if campanha['modelo'] == 'CPM':
-                # Calcula o CTR para CPM
-                soma_clicks = dados_campanha['Clicks'].sum()
-                ctr = (soma_clicks / volume_acumulado * 100) if volume_acumulado > 0 else 0
-                underperforming = "Sim" if ctr < 0.20 else "Não"
-                valor_underperforming = f"CTR: {ctr:.2f}%"  # Valor que determinou o Underperforming
-            elif campanha['modelo'] == 'CPV':
-                # Calcula a taxa de Complete Views para CPV
-                taxa_complete_views = (volume_acumulado / dados_campanha['Impressions'].sum() * 100) if dados_campanha['Impressions'].sum() > 0 else 0
-                underperforming = "Sim" if taxa_complete_views < 50 else "Não"
-                valor_underperforming = f"Complete Views: {taxa_complete_views:.2f}%"  # Valor que determinou o Underperforming
-            else:
-                underperforming = "Não"  # Caso o modelo não seja CPM ou CPV
-                valor_underperforming = "N/A"
-            
-            # Calcula a meta necessária por dia para bater a meta total
-            dias_restantes = (fim - data_atual).days
-            if dias_restantes > 0:
-                meta_necessaria_diaria = (float(campanha['volume_contratado']) - volume_acumulado) / dias_restantes
-            else:
-                meta_necessaria_diaria = 0  # Campanha já terminou
-            
-            # Adiciona os resultados
-            resultados.append({
-                "Campanha": campanha['insertion_order'],
-                "Modelo": campanha['modelo'],
-                "Volume Contratado": campanha['volume_contratado'],
-                "Meta Diária": meta_diaria,
-                "Volume Acumulado": volume_acumulado,  # Adicionado o volume acumulado
-                "Volume Esperado": volume_esperado,  # Adicionado o volume esperado
-                "Última Entrega": ultima_metrica,
-                "Pace": pace_acumulado,
-                "Status": status,
-                "Dias Restantes": dias_restantes,
-                "Início Campanha": inicio,
-                "Fim Campanha": fim,
-                "Underperforming": underperforming,
-                "Valor Underperforming": valor_underperforming,
-                "Meta Necessária Diária": meta_necessaria_diaria  # Nova coluna
-            })
-        except Exception as e:
-            st.error(f"Erro ao processar campanha: {campanha['insertion_order']}, Erro: {str(e)}")
-            continue
-    
-    return pd.DataFrame(resultados)
+@st.cache_data(ttl=300, show_spinner=False)
+def carregar_revenue(_client):
+    """Busca o revenue já agregado por campanha no BigQuery; fica em cache por 5 minutos"""
+    query = f"""
+    SELECT 
+        t.`Insertion Order` AS insertion_order,
+        SUM(t.Revenue) AS Revenue
+    {FROM_ENTREGAS_POR_CAMPANHA}
+    """
+    return executar_consulta(_client, query)
 
-def calcular_metricas_programatica(df_campanhas, df_daily):
-    resultados = []
-    
-    for _, campanha in df_campanhas.iterrows():
-        try:
-            # Pega o budget (investimento) da campanha
-            investimento = float(campanha['budget'].replace('R$', '').replace('.', '').replace(',', '.'))
-            
-            # Soma o revenue total para esta campanha
-            dados_campanha = df_daily[df_daily['Insertion Order'] == campanha['insertion_order']]
-            investimento_entregue = dados_campanha['Revenue'].sum()
-            
-            # Calcula a margem
-            margem = ((investimento - investimento_entregue) / investimento * 100) if investimento > 0 else 0
-            
-            resultados.append({
-                "Campanha": campanha['insertion_order'],
-                "Investimento Total": investimento,
-                "Investimento Entregue": investimento_entregue,
-                "Margem (%)": margem,
-                "Status": "Boa" if margem >= 30 else "Média" if margem >= 20 else "Ruim"
-            })
-        except Exception as e:
-            st.error(f"Erro ao processar campanha programática: {campanha['insertion_order']}, Erro: {str(e)}")
-            continue
-    
-    return pd.DataFrame(resultados)
+def get_revenue_data(client):
+    """Busca o revenue já agregado por campanha no BigQuery, com join nas condições especificadas"""
+    try:
+        return carregar_revenue(client)
+    except Exception as e:
+        st.error(f"Erro ao buscar revenue: {e}")
+        return None
+
+@st.cache_data(ttl=300, show_spinner=False)
+def calcular_metricas(df_campanhas, df_entregas, data_atual):
+    """Calcula pace, status e underperforming das campanhas ativas em data_atual"""
+    data_atual = pd.Timestamp(data_atual)
+
+    # Ignora campanhas que já terminaram antes de qualquer cálculo
+    df_campanhas = df_campanhas[df_campanhas['fim_campanha'].dt.normalize() >= data_atual]
+
+    # As entregas já chegam agregadas por campanha
+    df = df_campanhas.merge(df_entregas, on='insertion_order', how='left')
+    colunas_entrega = ['Impressions', 'Complete_Views', 'Clicks', 'Ultima_Impressions', 'Ultima_Complete_Views']
+    df[colunas_entrega] = df[colunas_entrega].fillna(0).astype(float)
+
+    inicio = df['inicio_campanha'].dt.normalize()
+    fim = df['fim_campanha'].dt.normalize()
+
+    # Calcula os dias totais e dias decorridos
+    dias_totais = (fim - inicio).dt.days + 1
+    dias_decorridos = (data_atual - inicio).dt.days + 1
+
+    # Calcula a meta diária
+    volume_contratado = df['volume_contratado'].astype(float)
+    meta_diaria = volume_contratado / dias_totais
+
+    # Calcula o volume acumulado (Impressions para CPM, Complete_Views para os demais)
+    cpm = df['modelo'].eq('CPM').to_numpy(dtype=bool, na_value=False)
+    cpv = df['modelo'].eq('CPV').to_numpy(dtype=bool, na_value=False)
+    volume_acumulado = df['Impressions'].where(cpm, df['Complete_Views'])
+    ultima_metrica = df['Ultima_Impressions'].where(cpm, df['Ultima_Complete_Views'])
+
+    # Calcula o volume esperado e o pace acumulado
+    volume_esperado = meta_diaria * dias_decorridos
+    pace_acumulado = np.where(volume_esperado > 0, volume_acumulado / volume_esperado * 100, 0)
+    status = pd.Categorical(
+        np.select([pace_acumulado < 90, pace_acumulado > 110], ["Under", "Over"], "On Track"),
+        categories=["Under", "On Track", "Over"],
+        ordered=True
+    )
+
+    # Underperforming: CTR para CPM e taxa de Complete Views para CPV
+    ctr = np.where(volume_acumulado > 0, df['Clicks'] / volume_acumulado * 100, 0)
+    taxa_complete_views = np.where(df['Impressions'] > 0, volume_acumulado / df['Impressions'] * 100, 0)
+    underperforming = np.where(
+        np.select([cpm, cpv], [ctr < 0.20, taxa_complete_views < 50], False), "Sim", "Não"
+    )
+    valor_underperforming = np.select(
+        [cpm, cpv],
+        [np.char.mod("CTR: %.2f%%", ctr), np.char.mod("Complete Views: %.2f%%", taxa_complete_views)],
+        "N/A"
+    )
+
+    # Calcula a meta necessária por dia para bater a meta total
+    dias_restantes = (fim - data_atual).dt.days
+    meta_necessaria_diaria = np.where(
+        dias_restantes > 0, (volume_contratado - volume_acumulado) / dias_restantes, 0
+    )
+
+    return pd.DataFrame({
+        "Campanha": df['insertion_order'],
+        "Modelo": df['modelo'],
+        "Volume Contratado": df['volume_contratado'],
+        "Meta Diária": meta_diaria,
+        "Volume Acumulado": volume_acumulado,
+        "Volume Esperado": volume_esperado,
+        "Última Entrega": ultima_metrica,
+        "Pace": pace_acumulado,
+        "Status": status,
+        "Dias Restantes": dias_restantes,
+        "Início Campanha": inicio.dt.date,
+        "Fim Campanha": fim.dt.date,
+        "Underperforming": underperforming,
+        "Valor Underperforming": valor_underperforming,
+        "Meta Necessária Diária": meta_necessaria_diaria
+    }).reset_index(drop=True)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def calcular_metricas_programatica(df_campanhas, df_revenue):
+    """Calcula investimento entregue, margem e status de cada campanha"""
+    # Ignora campanhas cujo budget não pôde ser convertido
+    df_campanhas = df_campanhas[df_campanhas['budget_num'].notna()]
+
+    # Budget (investimento) já convertido para número no carregamento
+    investimento = df_campanhas['budget_num']
+
+    # Revenue total por campanha (somado no BigQuery)
+    revenue = df_revenue.set_index('insertion_order')['Revenue']
+    investimento_entregue = df_campanhas['insertion_order'].map(revenue).fillna(0).astype(float)
+
+    # Calcula a margem
+    margem = np.where(investimento > 0, (investimento - investimento_entregue) / investimento * 100, 0)
+
+    return pd.DataFrame({
+        "Campanha": df_campanhas['insertion_order'],
+        "Investimento Total": investimento,
+        "Investimento Entregue": investimento_entregue,
+        "Margem (%)": margem,
+        "Status": pd.Categorical(
+            np.select([margem >= 30, margem >= 20], ["Boa", "Média"], "Ruim"),
+            categories=["Ruim", "Média", "Boa"],
+            ordered=True
+        )
+    }).reset_index(drop=True)
+
+CORES_STATUS = {"Under": "red", "Over": "lightcoral", "On Track": "green"}
+
+def estilo_status(status):
+    """Estilo da célula de Status na tabela do dashboard"""
+    return f"color: {CORES_STATUS.get(status, 'green')}; font-weight: bold;"
 
 def programatica_page():
     st.title("Campanhas Programática")
@@ -198,13 +264,19 @@ def programatica_page():
         
     try:
         df_campanhas = get_campaign_data(client)
-        df_daily = get_daily_data(client)
+        df_revenue = get_revenue_data(client)
         
-        if df_campanhas is None or df_daily is None:
+        if df_campanhas is None or df_revenue is None:
             st.error("Não foi possível carregar os dados das campanhas.")
             return
             
-        df_resultados = calcular_metricas_programatica(df_campanhas, df_daily)
+        budget_invalido = df_campanhas.loc[df_campanhas['budget_num'].isna(), 'insertion_order']
+        if not budget_invalido.empty:
+            st.warning(
+                "Campanhas ignoradas por budget inválido: " + ", ".join(budget_invalido.astype(str))
+            )
+            
+        df_resultados = calcular_metricas_programatica(df_campanhas, df_revenue)
         
         # Mostra as métricas gerais
         col1, col2, col3 = st.columns(3)
@@ -259,13 +331,13 @@ def dashboard_page():
         
     try:
         df_campanhas = get_campaign_data(client)
-        df_daily = get_daily_data(client)
+        df_entregas = get_delivery_data(client)
         
-        if df_campanhas is None or df_daily is None:
+        if df_campanhas is None or df_entregas is None:
             st.error("Não foi possível carregar os dados das campanhas.")
             return
             
-        df_resultados = calcular_metricas(df_campanhas, df_daily)
+        df_resultados = calcular_metricas(df_campanhas, df_entregas, datetime.now().date())
     except Exception as e:
         st.error(f"Erro ao processar dados: {e}")
         return
@@ -295,9 +367,10 @@ def dashboard_page():
         df_filtrado = df_filtrado[df_filtrado['Underperforming'] == underperforming_filtro]
     
     # KPIs
-    under = len(df_resultados[df_resultados['Status'] == 'Under'])
-    over = len(df_resultados[df_resultados['Status'] == 'Over'])
-    on_track = len(df_resultados[df_resultados['Status'] == 'On Track'])
+    contagem_status = df_resultados['Status'].value_counts()
+    under = contagem_status.get('Under', 0)
+    over = contagem_status.get('Over', 0)
+    on_track = contagem_status.get('On Track', 0)
     pace_medio = f"{df_resultados['Pace'].mean():.1f}%"
     
     card_css = """
@@ -347,50 +420,23 @@ def dashboard_page():
     
     st.write("### Status das Campanhas")
     
-    # Ajuste das colunas para incluir Volume Acumulado, Volume Esperado e Meta Necessária Diária
-    header_cols = st.columns([3, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1])
-    header_cols[0].markdown("**Campanha**")
-    header_cols[1].markdown("**Modelo**")
-    header_cols[2].markdown("**Volume Contratado**")
-    header_cols[3].markdown("**Meta Diária**")
-    header_cols[4].markdown("**Volume Acumulado**")
-    header_cols[5].markdown("**Volume Esperado**")
-    header_cols[6].markdown("**Última Entrega**")
-    header_cols[7].markdown("**Pace**")
-    header_cols[8].markdown("**Status**")
-    header_cols[9].markdown("**Dias Restantes**")
-    header_cols[10].markdown("**Início Campanha**")
-    header_cols[11].markdown("**Fim Campanha**")
-    header_cols[12].markdown("**Underperforming**")
-    header_cols[13].markdown("**Meta Necessária Diária**")
-    st.markdown("<hr>", unsafe_allow_html=True)
-    
-    for idx, row in df_filtrado.iterrows():
-        row_cols = st.columns([3, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1])
-        row_cols[0].write(row['Campanha'])
-        row_cols[1].write(row['Modelo'])
-        row_cols[2].write(f"{row['Volume Contratado']:,.0f}")
-        row_cols[3].write(f"{row['Meta Diária']:,.0f}")
-        row_cols[4].write(f"{row['Volume Acumulado']:,.0f}")  # Volume Acumulado
-        row_cols[5].write(f"{row['Volume Esperado']:,.0f}")  # Volume Esperado
-        row_cols[6].write(f"{row['Última Entrega']:,.0f}")
-        row_cols[7].write(f"{row['Pace']:.1f}%")
-        if row['Status'] == "Under":
-                        status_color = "red"
-        elif row['Status'] == "Over":
-            status_color = "lightcoral"
-        else:
-            status_color = "green"
-        row_cols[8].markdown(
-            f"<span style='color: {status_color}; font-weight: bold;'>{row['Status']}</span>",
-            unsafe_allow_html=True
-        )
-        row_cols[9].write(row['Dias Restantes'])
-        row_cols[10].write(row['Início Campanha'])
-        row_cols[11].write(row['Fim Campanha'])
-        row_cols[12].write(row['Underperforming'])
-        row_cols[13].write(f"{row['Meta Necessária Diária']:,.0f}")  # Meta Necessária Diária
-        st.markdown("<hr>", unsafe_allow_html=True)
+    # Formatação da tabela
+    df_display = df_filtrado[[
+        "Campanha", "Modelo", "Volume Contratado", "Meta Diária", "Volume Acumulado",
+        "Volume Esperado", "Última Entrega", "Pace", "Status", "Dias Restantes",
+        "Início Campanha", "Fim Campanha", "Underperforming", "Meta Necessária Diária"
+    ]].copy()
+    for coluna in ["Volume Contratado", "Meta Diária", "Volume Acumulado", "Volume Esperado",
+                   "Última Entrega", "Meta Necessária Diária"]:
+        df_display[coluna] = df_display[coluna].map('{:,.0f}'.format)
+    df_display['Pace'] = df_display['Pace'].map('{:.1f}%'.format)
+
+    # Uma única tabela no lugar de uma linha de st.columns por campanha
+    st.dataframe(
+        df_display.style.map(estilo_status, subset=['Status']),
+        use_container_width=True,
+        hide_index=True
+    )
 
 def main():
     st.set_page_config(page_title="Dashboard de Campanhas", page_icon="📊", layout="wide")